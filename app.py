@@ -1,8 +1,13 @@
 # app.py - Complete Indian Market Price Solution
 import streamlit as st
 import pandas as pd
-import numpy as np
+import altair as alt
 from datetime import datetime
+import csv
+import hashlib
+import hmac
+import importlib.util
+import io
 import os
 
 # ======================
@@ -10,32 +15,92 @@ import os
 # ======================
 
 PRICE_FILE = "indian_prices.csv"
+PRICE_SNAPSHOT = "indian_prices.parquet"  # typed copy of PRICE_FILE
+DATE_FORMAT = "%m/%d/%Y"  # e.g. 1/31/2025
+# pyarrow parses CSV on multiple threads; fall back to the C parser without it
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
 FALLBACK_PRICES = {
     'Wheat': 2250,  # ₹ per quintal
     'Rice': 3150,
     'Potatoes': 850,
     'Tomatoes': 1250
 }
+crops = ['Wheat', 'Rice', 'Potatoes', 'Tomatoes']
+# Rupee prices fit comfortably in float32 and dates need no sub-second part
+PRICE_DTYPES = {'Date': 'datetime64[s]', **dict.fromkeys(crops, 'float32')}
+REQUIRED_COLUMNS = frozenset(PRICE_DTYPES)
 
-def load_price_data():
+def price_file_signature():
+    """Identify the current contents of PRICE_FILE by modification time and size"""
+    stat = os.stat(PRICE_FILE)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def read_price_snapshot(source):
+    """Return the Parquet snapshot if it was built from this exact CSV, else None"""
+    try:
+        snapshot = pd.read_parquet(PRICE_SNAPSHOT)
+        if snapshot.attrs.get('source') == source:
+            # Parquet has no second-resolution timestamps, so restore our dtypes
+            return snapshot.astype(PRICE_DTYPES)
+    except Exception:
+        # Missing, unreadable or corrupt snapshot: parse the CSV instead
+        pass
+    return None
+
+def write_price_snapshot(df, source):
+    """Save parsed prices as Parquet so later loads skip CSV parsing"""
+    tmp_file = PRICE_SNAPSHOT + '.tmp'
+    try:
+        snapshot = df.copy(deep=False)
+        snapshot.attrs['source'] = source
+        snapshot.to_parquet(tmp_file, compression='zstd', index=False)
+        # Swap in the new snapshot only once it is fully written
+        os.replace(tmp_file, PRICE_SNAPSHOT)
+    except Exception:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def read_price_data():
     """Load prices with improved error handling"""
     try:
-        df = pd.read_csv("indian_prices.csv")
+        # Taken before reading, so a concurrent append invalidates the snapshot
+        source = price_file_signature()
+        snapshot = read_price_snapshot(source)
+        if snapshot is not None:
+            return snapshot
 
-        # Trim spaces from column names
-        df.columns = df.columns.str.strip()
+        # Read just the header first, mapping trimmed names to raw ones
+        columns = {col.strip(): col for col in pd.read_csv(PRICE_FILE, nrows=0).columns}
 
-        # Ensure "Date" column exists
-        if "Date" not in df.columns:
-            st.error("CSV file is missing the 'Date' column! Please check your data.")
+        # Ensure "Date" and every crop column exist
+        try:
+            usecols = [columns[col] for col in ['Date'] + crops]
+        except KeyError as e:
+            st.error(f"CSV file is missing the {e} column! Please check your data.")
             return pd.DataFrame()
 
-        # Convert "Date" column to datetime format safely
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        # Parse only the columns we use, converting "Date" inline while reading
+        df = pd.read_csv(
+            PRICE_FILE,
+            engine=CSV_ENGINE,
+            usecols=usecols,
+            dtype={columns[crop]: 'float32' for crop in crops},
+            parse_dates=[columns['Date']],
+            date_format=DATE_FORMAT
+        )
+
+        # Trim spaces from column names
+        df.columns = df.columns.str.strip()
+
+        # Dates in any other layout are left as text; parse them safely
+        if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+            df['Date'] = pd.to_datetime(df['Date'], format='mixed', errors='coerce')
 
-        # Drop rows where Date conversion failed
-        df = df.dropna(subset=['Date'])
+        # Drop rows where Date conversion failed, keep history in date order
+        df = df.dropna(subset=['Date']).astype(PRICE_DTYPES)
+        df = df.sort_values('Date', kind='stable', ignore_index=True)
 
+        write_price_snapshot(df, source)
         return df
 
     except FileNotFoundError:
@@ -43,23 +108,116 @@ def load_price_data():
         return pd.DataFrame({
             'Date': [datetime.today()],
             **FALLBACK_PRICES
-        })
+        }).astype(PRICE_DTYPES)
     except Exception as e:
         st.error(f"Error loading price data: {str(e)}")
         return pd.DataFrame()
 
+def append_price_entry(entry):
+    """Append one row to PRICE_FILE, following the file's own column order and line endings"""
+    # A missing or zero-byte file gets a header first
+    has_header = os.path.exists(PRICE_FILE) and os.path.getsize(PRICE_FILE) > 0
+    columns, lineterminator, terminate_last_line = None, '\n', False
+    if has_header:
+        columns = pd.read_csv(PRICE_FILE, nrows=0).columns.str.strip()
+        with open(PRICE_FILE, 'rb') as f:
+            if f.readline().endswith(b'\r\n'):
+                lineterminator = '\r\n'
+            # Hand-edited files may lack a final newline; don't glue rows together
+            f.seek(-1, os.SEEK_END)
+            terminate_last_line = f.read(1) not in (b'\n', b'\r')
+    with open(PRICE_FILE, 'a', encoding='utf-8', newline='') as f:
+        if terminate_last_line:
+            f.write(lineterminator)
+        pd.DataFrame([entry], columns=columns).to_csv(
+            f,
+            header=not has_header,
+            index=False,
+            lineterminator=lineterminator
+        )
+
+def save_uploaded_prices(upload):
+    """Stream an uploaded CSV into PRICE_FILE row by row, trimming header names"""
+    upload.seek(0)
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    tmp_file = PRICE_FILE + '.tmp'
+    try:
+        rows = csv.reader(text)
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow([col.strip() for col in next(rows)])
+            writer.writerows(rows)
+        # Swap in the new file only once it is fully written
+        os.replace(tmp_file, PRICE_FILE)
+    except Exception:
+        # Don't leave a half-written copy behind (e.g. a non-UTF-8 upload)
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    finally:
+        text.detach()
+
+def compute_stats(df):
+    """Per-crop average, latest price, day-on-day change and selling signal,
+    computed once per dataset"""
+    no_change = dict.fromkeys(crops, 0)
+    if df.empty:
+        return FALLBACK_PRICES, FALLBACK_PRICES, no_change, dict.fromkeys(crops, 'stable')
+    prices = df[crops]
+    # Back to float64 rounded to paise, so float32 noise never reaches the
+    # manual-entry defaults and from there the CSV
+    averages = prices.mean().astype('float64').round(2)
+    current = prices.iloc[-1].astype('float64').round(2)
+    # Both rows in one slice, all crops in one subtraction
+    last_two = prices.to_numpy()[-2:]
+    deltas = dict(zip(crops, (last_two[1] - last_two[0]).tolist())) if len(last_two) > 1 else no_change
+    # Sell when 15% above average, hold when 15% below, for all crops at once
+    ratios = current / averages
+    signals = pd.Series('stable', index=crops).mask(ratios > 1.15, 'sell').mask(ratios < 0.85, 'hold')
+    return averages.to_dict(), current.to_dict(), deltas, signals.to_dict()
+
+# cache_resource hands every rerun and session the same DataFrame without
+# copying it: treat the result as read-only, write changes to PRICE_FILE and
+# call load_price_data.clear() instead
+@st.cache_resource(ttl=3600, show_spinner=False)
+def load_price_data():
+    """Load prices and their per-crop stats once (cached across reruns)"""
+    df = read_price_data()
+    return df, compute_stats(df)
+
+def slice_for_chart(df, start, end):
+    """Price history between two dates, indexed by Date for charting"""
+    # Dates are sorted at load time, so a binary search bounds the slice
+    lo = df['Date'].searchsorted(start, side='left')
+    hi = df['Date'].searchsorted(end, side='right')
+    return df.iloc[lo:hi].set_index('Date')[crops]
+
+@st.cache_data(show_spinner=False)
+def build_price_chart(df, start, end):
+    """Stacked area chart of price history between two dates"""
+    history = slice_for_chart(df, start, end).reset_index().melt('Date', var_name='Crop', value_name='Price')
+    return alt.Chart(history).mark_area().encode(
+        x='Date:T',
+        y=alt.Y('Price:Q', stack=True),
+        color=alt.Color('Crop:N', sort=crops)
+    ).properties(height=400)
+
+@st.cache_resource
+def admin_pass_digest():
+    """SHA-256 digest of the admin password, computed once per server"""
+    return hashlib.sha256(st.secrets.get("ADMIN_PASS", "farmconnect2024").encode()).digest()
+
+def is_admin_password(password):
+    """Check a password against the admin secret in constant time"""
+    return hmac.compare_digest(hashlib.sha256(password.encode()).digest(), admin_pass_digest())
+
 # =================
 # STREAMLIT INTERFACE
 # =================
 
-st.set_page_config(
-    page_title="AgriSure - Market Intelligence",
-    layout="wide",
-    page_icon="🌾"
-)
-
-# Custom CSS
-st.markdown("""
+# Custom CSS. Streamlit drops any element a rerun does not emit again, so
+# this has to be re-sent on every run rather than injected once per session
+CUSTOM_CSS = """
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap');
 
@@ -110,7 +268,37 @@ st.markdown("""
     padding-left: 1rem;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Recommendation card for each selling signal from compute_stats()
+RECOMMENDATION_CARDS = {
+    'sell': """
+            <div class='card recommendation-card' style='border-color: #2c5f2d'>
+                <h3 style='color:#2c5f2d; margin:0'>🚜 Good to Sell</h3>
+                <p style='color:#666; margin:0.5rem 0'>Current prices are 15% above average</p>
+            </div>
+            """,
+    'hold': """
+            <div class='card recommendation-card' style='border-color: #cc3300'>
+                <h3 style='color:#cc3300; margin:0'>⏳ Hold Stock</h3>
+                <p style='color:#666; margin:0.5rem 0'>Current prices are 15% below average</p>
+            </div>
+            """,
+    'stable': """
+            <div class='card recommendation-card' style='border-color: #666'>
+                <h3 style='color:#666; margin:0'>⚖️ Market Stable</h3>
+                <p style='color:#666; margin:0.5rem 0'>Prices within normal fluctuation range</p>
+            </div>
+            """
+}
+
+st.set_page_config(
+    page_title="AgriSure - Market Intelligence",
+    layout="wide",
+    page_icon="🌾"
+)
+
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # Header
 with st.container():
@@ -119,14 +307,10 @@ with st.container():
     st.markdown("**Real-time Agricultural Price Monitoring & Decision Support System**")
     st.markdown("</div>", unsafe_allow_html=True)
 
-# Main Tabs
-tab1, tab2, tab3 = st.tabs(["📊 Market Dashboard", "📈 Price Advisor", "🔒 Data Management"])
-
-price_df = load_price_data()
-latest = price_df.iloc[-1] if not price_df.empty else FALLBACK_PRICES
-crops = ['Wheat', 'Rice', 'Potatoes', 'Tomatoes']
-
-with tab1:
+# Each tab is a fragment, so its widgets rerun only that tab
+@st.fragment
+def render_dashboard(price_df, latest, deltas):
+    """Current prices and price history chart"""
     # Current Prices Section
     st.subheader("Current Market Prices")
     cols = st.columns(4)
@@ -134,7 +318,7 @@ with tab1:
     
     for idx, crop in enumerate(crops):
         with cols[idx]:
-            delta = latest[crop] - price_df.iloc[-2][crop] if len(price_df) > 1 else 0
+            delta = deltas[crop]
             delta_color = "inverse"
             if delta > 0:
                 delta_color = "normal"
@@ -157,21 +341,18 @@ with tab1:
     
     # Price History Chart
     with col1:
-        filtered_df = price_df[(price_df['Date'] >= pd.to_datetime(date_range[0])) & 
-                              (price_df['Date'] <= pd.to_datetime(date_range[1]))]
-        st.area_chart(
-            filtered_df.set_index('Date')[crops],
-            use_container_width=True,
-            height=400
-        )
+        price_chart = build_price_chart(price_df, pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1]))
+        st.altair_chart(price_chart, use_container_width=True)
 
-with tab2:
+@st.fragment
+def render_advisor(latest, avg_prices, signals):
+    """Selling recommendation and profit estimate for one crop"""
     # Price Recommendation System
     st.subheader("Selling Recommendations")
     selected_crop = st.selectbox("Select Your Crop", crops, key='crop_select')
     
     current_price = latest[selected_crop]
-    avg_price = price_df[selected_crop].mean()
+    avg_price = avg_prices[selected_crop]
     
     # Price Comparison
     cols = st.columns(3)
@@ -184,28 +365,10 @@ with tab2:
     
     # Recommendation Logic
     with cols[2]:
-        if current_price > avg_price * 1.15:
-            st.markdown("""
-            <div class='card recommendation-card' style='border-color: #2c5f2d'>
-                <h3 style='color:#2c5f2d; margin:0'>🚜 Good to Sell</h3>
-                <p style='color:#666; margin:0.5rem 0'>Current prices are 15% above average</p>
-            </div>
-            """, unsafe_allow_html=True)
+        signal = signals[selected_crop]
+        st.markdown(RECOMMENDATION_CARDS[signal], unsafe_allow_html=True)
+        if signal == 'sell':
             st.balloons()
-        elif current_price < avg_price * 0.85:
-            st.markdown("""
-            <div class='card recommendation-card' style='border-color: #cc3300'>
-                <h3 style='color:#cc3300; margin:0'>⏳ Hold Stock</h3>
-                <p style='color:#666; margin:0.5rem 0'>Current prices are 15% below average</p>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown("""
-            <div class='card recommendation-card' style='border-color: #666'>
-                <h3 style='color:#666; margin:0'>⚖️ Market Stable</h3>
-                <p style='color:#666; margin:0.5rem 0'>Prices within normal fluctuation range</p>
-            </div>
-            """, unsafe_allow_html=True)
     
     # Profit Calculator
     st.markdown("---")
@@ -221,14 +384,16 @@ with tab2:
         </div>
         """, unsafe_allow_html=True)
 
-with tab3:
+@st.fragment
+def render_admin(latest):
+    """Password-protected CSV upload and manual price entry"""
     # Data Management System
     st.subheader("Data Management Portal")
     
     if st.toggle("Enable Admin Mode"):
         admin_pass = st.text_input("Enter Admin Password", type="password")
         
-        if admin_pass == st.secrets.get("ADMIN_PASS", "farmconnect2024"):
+        if is_admin_password(admin_pass):
             st.success("🔐 Administrator Access Granted")
             
             # Data Update Section
@@ -240,14 +405,21 @@ with tab3:
                 new_file = st.file_uploader("Upload Updated CSV", type="csv")
                 if new_file:
                     try:
-                        new_df = pd.read_csv(new_file)
-                        if st.button("Preview Data"):
-                            st.dataframe(new_df.head())
-                        
-                        if st.button("Commit Changes", type="primary"):
-                            new_df.to_csv(PRICE_FILE, index=False)
-                            st.success("Database updated successfully!")
-                            st.rerun()
+                        # Only the header is parsed up front; rows are streamed on commit
+                        new_file.seek(0)
+                        header = pd.read_csv(new_file, nrows=0).columns.str.strip()
+                        if not REQUIRED_COLUMNS.issubset(header):
+                            st.error(f"CSV file must contain the columns: {', '.join(PRICE_DTYPES)}")
+                        else:
+                            if st.button("Preview Data"):
+                                new_file.seek(0)
+                                st.dataframe(pd.read_csv(new_file, nrows=5))
+
+                            if st.button("Commit Changes", type="primary"):
+                                save_uploaded_prices(new_file)
+                                load_price_data.clear()
+                                st.success("Database updated successfully!")
+                                st.rerun()
                     except Exception as e:
                         st.error(f"Error processing file: {str(e)}")
             
@@ -265,20 +437,35 @@ with tab3:
                     
                     if st.form_submit_button("Submit Entry", type="primary"):
                         new_entry = {
-                            'Date': entry_date,
+                            'Date': entry_date.strftime(DATE_FORMAT),
                             'Wheat': wheat,
                             'Rice': rice,
                             'Potatoes': potatoes,
                             'Tomatoes': tomatoes
                         }
-                        price_df.loc[len(price_df)] = new_entry
-                        price_df.to_csv(PRICE_FILE, index=False)
+                        append_price_entry(new_entry)
+                        load_price_data.clear()
                         st.success("Entry successfully added!")
                         st.rerun()
         
         elif admin_pass:
             st.error("Incorrect Admin Password")
 
+# Main Tabs
+tab1, tab2, tab3 = st.tabs(["📊 Market Dashboard", "📈 Price Advisor", "🔒 Data Management"])
+
+price_df, stats = load_price_data()
+avg_prices, latest, deltas, signals = stats
+
+with tab1:
+    render_dashboard(price_df, latest, deltas)
+
+with tab2:
+    render_advisor(latest, avg_prices, signals)
+
+with tab3:
+    render_admin(latest)
+
 # Footer
 st.markdown("---")
 st.markdown("""